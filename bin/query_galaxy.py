@@ -52,6 +52,15 @@ def main():
         default=None,
         help="specify a hint",
     )
+    parser.add_argument(
+        "-w",
+        "--max-workers",
+        dest="max_workers",
+        default=None,
+        type=int,
+        help="number of processes used to index the galaxies (only useful for very large "
+             "galaxies on multi-core hosts, otherwise slower than the default)",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -75,7 +84,7 @@ def main():
         verbose=True,
         force=args.force_download,
     )
-    discerners = galaxy_parser.get_discerners(galaxy_manager)
+    discerners = galaxy_parser.get_discerners(galaxy_manager, max_workers=args.max_workers)
 
     # Process
     labels = []
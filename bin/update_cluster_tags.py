@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """Script to replace stale cluster tags."""
 import argparse
+import collections
+import concurrent.futures
 import configparser
 import logging
 import pymisp
@@ -25,28 +27,15 @@ logging.basicConfig(
     level=logging.INFO,
 )
 
+# Prefix of all galaxy cluster tags
+GALAXY_TAG_PREFIX = "misp-galaxy:"
+
 # Galaxies whose clusters have a suffix-based identity
 SUFFIX_BASED_GALAXIES = frozenset([
     "mitre-attack-pattern",  # MITRE techniques can be renamed, but the technique id remains
 ])
 
 
-def is_tag_stale__by_suffix(instance_tag: str, tag: str, separator: Optional[str] = None) -> bool:
-    """Return whether the instance tag is stale by looking at the suffix (after separator)."""
-    if instance_tag == tag:
-        return False
-    if not separator:
-        separator = " - "
-    return instance_tag.split(separator)[-1] == tag.split(separator)[-1]
-
-
-def is_tag_stale__by_synonym(instance_tag: str, tag: str, synonyms: Dict[str, Set[str]]) -> bool:
-    """Return whether the instance tag is stale by checking if it is a synonym now."""
-    if instance_tag == tag:
-        return False
-    return instance_tag in synonyms[tag]
-
-
 def create_cluster_tag(galaxy_prefix: str, value: str) -> str:
     """Create a galaxy cluster tag given the galaxy prefix and the tag value."""
     return f"{galaxy_prefix}=\"{value}\""
@@ -62,17 +51,54 @@ def get_tag_synonyms(galaxy_values: Iterable[Dict], galaxy_prefix: str) -> Dict[
     return tag_synonyms
 
 
-def get_galaxy_names_from_tag_names(tag_names: Iterable[str]) -> List[str]:
-    """Return all galaxy names from the provided tag names."""
-    tag_galaxy_names = set([])
+def get_tag_by_synonym(
+    tag_synonyms: Dict[str, Set[str]],
+    conflicting_tags: Optional[Dict[str, Set[str]]] = None,
+) -> Dict[str, str]:
+    """Return a mapping from each synonym to the tag it should be replaced with.
+
+    The first tag claiming a synonym wins; if 'conflicting_tags' is provided, it is filled with
+    the other tags claiming the same synonym.
+    """
+    tag_by_synonym = {}
+    for tag, synonyms in tag_synonyms.items():
+        for synonym in synonyms:
+            synonym_tag = tag_by_synonym.setdefault(synonym, tag)
+            if synonym_tag != tag and conflicting_tags is not None:
+                conflicting_tags.setdefault(synonym, set()).add(tag)
+    return tag_by_synonym
+
+
+def get_tag_suffix(tag: str, separator: Optional[str] = None) -> str:
+    """Return the suffix of a tag (after separator)."""
+    if not separator:
+        separator = " - "
+    return tag.rpartition(separator)[2]
+
+
+def get_tag_by_suffix(tags: Iterable[str], separator: Optional[str] = None) -> Dict[str, str]:
+    """Return a mapping from each tag suffix (after separator) to the (last) tag with it."""
+    return {get_tag_suffix(tag, separator): tag for tag in tags}
+
+
+def get_galaxy_name_from_tag_name(tag_name: str) -> Optional[str]:
+    """Return the galaxy name of the provided tag name, or None if not a galaxy tag."""
+    if not tag_name.startswith(GALAXY_TAG_PREFIX):
+        return None
+    separator_idx = tag_name.find("=", len(GALAXY_TAG_PREFIX))
+    if separator_idx < 0:
+        return None
+    return tag_name[len(GALAXY_TAG_PREFIX):separator_idx]
+
+
+def get_tag_names_by_galaxy_name(tag_names: Iterable[str]) -> Dict[str, List[str]]:
+    """Return the provided tag names grouped by galaxy name (non-galaxy tags are discarded)."""
+    tag_names_by_galaxy_name = collections.defaultdict(list)
     for tag_name in tag_names:
-        try:
-            tag_category, tag_galaxy = tag_name.split("=")[0].split(":")
-            if tag_category == "misp-galaxy":
-                tag_galaxy_names.add(tag_galaxy)
-        except (IndexError, ValueError):
-            continue
-    return sorted(tag_galaxy_names)
+        tag_galaxy = get_galaxy_name_from_tag_name(tag_name)
+        if tag_galaxy:
+            tag_names_by_galaxy_name[tag_galaxy].append(tag_name)
+    return tag_names_by_galaxy_name
 
 
 def get_or_create_tag_object(misp: pymisp.PyMISP, tag: str) -> pymisp.MISPTag:
@@ -86,22 +112,44 @@ def get_or_create_tag_object(misp: pymisp.PyMISP, tag: str) -> pymisp.MISPTag:
     return tag_object
 
 
-def search_and_replace_tag(
+def get_stale_tag_names(
+    entity: Union[pymisp.MISPAttribute, pymisp.MISPEvent],
+    old_tag_to_new_tag: Dict[str, str],
+) -> List[str]:
+    """Return the names of the tags of an entity that should be replaced."""
+    return [x.name for x in entity.tags if x.name in old_tag_to_new_tag]
+
+
+def search_and_replace_tags(
     misp: pymisp.PyMISP,
     entity: Union[pymisp.MISPAttribute, pymisp.MISPEvent],
-    old_tag: str,
-    new_tag: str,
+    old_tag_to_new_tag: Dict[str, str],
+    tag_object_by_name: Dict[str, pymisp.MISPTag],
 ) -> None:
-    """Given an entity, replace old tag with new tag."""
+    """Given an entity, replace all old tags with the respective new tags."""
     tag_by_name = {x.name: x for x in entity.tags}
-    # If the entity does not have any old tags, exit
-    if old_tag not in tag_by_name:
-        return
-    # If the entity does not have any new tag, tag it
-    if new_tag not in tag_by_name:
-        misp.tag(entity, get_or_create_tag_object(misp, new_tag))
+    old_tags = [x for x in tag_by_name if x in old_tag_to_new_tag]
+    # If the entity does not have a new tag, tag it (once, even if more old tags map to it)
+    new_tags = dict.fromkeys(old_tag_to_new_tag[x] for x in old_tags)
+    for new_tag in new_tags:
+        if new_tag in tag_by_name:
+            continue
+        if new_tag not in tag_object_by_name:
+            tag_object_by_name[new_tag] = get_or_create_tag_object(misp, new_tag)
+        misp.tag(entity, tag_object_by_name[new_tag])
     # Remove from the entity any old tag
-    misp.untag(entity, tag_by_name[old_tag])
+    for old_tag in old_tags:
+        misp.untag(entity, tag_by_name[old_tag])
+
+
+def get_misp(conf: configparser.ConfigParser) -> pymisp.PyMISP:
+    """Create a MISP client from the configuration."""
+    return pymisp.PyMISP(
+        url=conf.get("misp", "url"),
+        key=conf.get("misp", "key"),
+        ssl=conf.getboolean("misp", "verify_ssl", fallback=False),
+        debug=conf.getboolean("misp", "debug", fallback=False),
+    )
 
 
 def main() -> int:
@@ -130,17 +178,13 @@ def main() -> int:
 
     # Load MISP
     logger = logging.getLogger(__name__)
-    misp = pymisp.PyMISP(
-        url=conf.get("misp", "url"),
-        key=conf.get("misp", "key"),
-        ssl=conf.getboolean("misp", "verify_ssl", fallback=False),
-        debug=conf.getboolean("misp", "debug", fallback=False),
-    )
+    misp = get_misp(conf)
 
     # Load the galaxy manager
     instance_tags = misp.tags(pythonify=True)
     instance_tags_by_name = {x.name: x for x in instance_tags}
-    instance_galaxy_names = get_galaxy_names_from_tag_names(instance_tags_by_name.keys())
+    instance_tags_by_galaxy_name = get_tag_names_by_galaxy_name(instance_tags_by_name.keys())
+    instance_galaxy_names = sorted(instance_tags_by_galaxy_name.keys())
     galaxy_manager = galaxy.GalaxyManagerMISP(
         misp=misp,
         galaxy_names=instance_galaxy_names,
@@ -152,52 +196,72 @@ def main() -> int:
     for galaxy_name in galaxy_manager.galaxy_names:
         galaxy_values = galaxy_manager.get_galaxy(galaxy_name)["values"]
         galaxy_prefix = galaxy_manager.get_tag_prefix(galaxy_name)
+        # keep the galaxy order so that indexes built from it are deterministic
         galaxy_tags = [create_cluster_tag(galaxy_prefix, x["value"]) for x in galaxy_values]
+        galaxy_tags_set = set(galaxy_tags)
         galaxy_tag_synonyms = get_tag_synonyms(galaxy_values, galaxy_prefix)
+        galaxy_conflicting_tags = {}
+        galaxy_tag_by_synonym = get_tag_by_synonym(galaxy_tag_synonyms, galaxy_conflicting_tags)
+        if galaxy_name in SUFFIX_BASED_GALAXIES:
+            galaxy_tag_by_suffix = get_tag_by_suffix(galaxy_tags)
+        else:
+            galaxy_tag_by_suffix = {}
         # iterate over all instance tags and check whether they should be promoted
-        for instance_tag in instance_tags_by_name.keys():
-            # if the tag from misp is not a galaxy tag, skip it
-            if not instance_tag.startswith(f"misp-galaxy:{galaxy_name}"):
-                continue
+        for instance_tag in instance_tags_by_galaxy_name.get(galaxy_name, []):
             # if the tag from misp is in the galaxy, we can skip it
-            if instance_tag in galaxy_tags:
+            if instance_tag in galaxy_tags_set:
                 continue
-            # otherwise let's process all galaxy tags
-            for galaxy_tag in galaxy_tags:
-                replace = is_tag_stale__by_synonym(instance_tag, galaxy_tag, galaxy_tag_synonyms)
-                if not replace and galaxy_name in SUFFIX_BASED_GALAXIES:
-                    replace = is_tag_stale__by_suffix(instance_tag, galaxy_tag)
-                if replace:
-                    logger.info(f"Tag '{instance_tag}' should be replaced with '{galaxy_tag}'")
-                    old_tag_to_new_tag[instance_tag] = galaxy_tag
-
-    # Search for tags in existing events
-    logger.info("Processing events")
-    for idx, (old_tag, new_tag) in enumerate(old_tag_to_new_tag.items(), start=1):
-        logger.info(f"[{idx}/{len(old_tag_to_new_tag)}] Replacing tag '{old_tag}' with '{new_tag}'")
+            # otherwise check whether it is now a synonym or shares the suffix with a galaxy tag
+            galaxy_tag = galaxy_tag_by_synonym.get(instance_tag)
+            if galaxy_tag and instance_tag in galaxy_conflicting_tags:
+                logger.warning(
+                    f"Tag '{instance_tag}' is a synonym of '{galaxy_tag}' but also of "
+                    f"{sorted(galaxy_conflicting_tags[instance_tag])}, using the former"
+                )
+            if not galaxy_tag and galaxy_tag_by_suffix:
+                galaxy_tag = galaxy_tag_by_suffix.get(get_tag_suffix(instance_tag))
+            if galaxy_tag:
+                logger.info(f"Tag '{instance_tag}' should be replaced with '{galaxy_tag}'")
+                old_tag_to_new_tag[instance_tag] = galaxy_tag
+
+    if not old_tag_to_new_tag:
+        logger.info("No tags to replace")
+        return 0
+
+    # Tag objects are shared across entities, so only look them up once
+    tag_object_by_name = {}
+
+    # Search for tags in existing events and attributes; attributes are fetched in the background
+    # while events are being processed, using a separate client (sessions are not thread-safe)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        attributes_future = executor.submit(
+            get_misp(conf).search,
+            controller="attributes",
+            tags=list(old_tag_to_new_tag),
+            pythonify=True,
+        )
+
+        logger.info("Processing events")
         events = misp.search(
             controller="events",
-            event_tags=old_tag,
+            event_tags=list(old_tag_to_new_tag),
             pythonify=True,
         )
-        for idx2, event in enumerate(events, start=1):
-            logger.info(f"\t[{idx2}/{len(events)}] Processing event '{event.info}'")
+        for idx, event in enumerate(events, start=1):
+            logger.info(f"[{idx}/{len(events)}] Processing event '{event.info}'")
+            for old_tag in get_stale_tag_names(event, old_tag_to_new_tag):
+                logger.info(f"\tReplacing tag '{old_tag}' with '{old_tag_to_new_tag[old_tag]}'")
             if not args.dry_run:
-                search_and_replace_tag(misp, event, old_tag, new_tag)
+                search_and_replace_tags(misp, event, old_tag_to_new_tag, tag_object_by_name)
 
-    # Search for tags in existing attributes
-    logger.info("Processing attributes")
-    for idx, (old_tag, new_tag) in enumerate(old_tag_to_new_tag.items(), start=1):
-        logger.info(f"[{idx}/{len(old_tag_to_new_tag)}] Replacing tag '{old_tag}' with '{new_tag}'")
-        attributes = misp.search(
-            controller="attributes",
-            tags=old_tag,
-            pythonify=True,
-        )
-        for idx2, attribute in enumerate(attributes, start=1):
-            logger.info(f"\t[{idx2}/{len(attributes)}] Processing attribute '{attribute.uuid}'")
+        logger.info("Processing attributes")
+        attributes = attributes_future.result()
+        for idx, attribute in enumerate(attributes, start=1):
+            logger.info(f"[{idx}/{len(attributes)}] Processing attribute '{attribute.uuid}'")
+            for old_tag in get_stale_tag_names(attribute, old_tag_to_new_tag):
+                logger.info(f"\tReplacing tag '{old_tag}' with '{old_tag_to_new_tag[old_tag]}'")
             if not args.dry_run:
-                search_and_replace_tag(misp, attribute, old_tag, new_tag)
+                search_and_replace_tags(misp, attribute, old_tag_to_new_tag, tag_object_by_name)
 
     return 0
 
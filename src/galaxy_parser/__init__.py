@@ -1,5 +1,7 @@
 # Copyright 2022 VMware, Inc.
 # SPDX-License-Identifier: BSD-2
+import concurrent.futures
+
 from galaxy_parser import discerner
 from galaxy_parser import exceptions
 from galaxy_parser import galaxy
@@ -10,16 +12,46 @@ from typing import List
 from typing import Optional
 
 
+def _build_discerner_index(galaxy_name: str, source: str, galaxy_object: Dict) -> Dict:
+    """Return the index of a dynamically created discerner for the given galaxy."""
+    new_type = discerner.BaseDiscerner.create_class(galaxy_name, source)
+    return new_type._build_index(galaxy_object)
+
+
 def get_discerners(
     galaxy_manager: galaxy.BaseGalaxyManagerSubType,
-    source: str = None
+    source: str = None,
+    max_workers: Optional[int] = None,
 ) -> List[discerner.BaseDiscernerSubType]:
-    """Return a list of dynamically created discerners."""
-    discerners = []
-    for galaxy_name in galaxy_manager.galaxy_names:
-        new_type = discerner.BaseDiscerner.create_class(galaxy_name, source or "custom")
-        discerners.append(new_type(galaxy_manager))
-    return discerners
+    """Return a list of dynamically created discerners.
+
+    If 'max_workers' is provided, indexes are built in separate processes.
+    """
+    source = source or "custom"
+    galaxy_names = list(galaxy_manager.galaxy_names)
+    if not max_workers or max_workers < 2 or len(galaxy_names) < 2:
+        discerners = []
+        for galaxy_name in galaxy_names:
+            new_type = discerner.BaseDiscerner.create_class(galaxy_name, source)
+            discerners.append(new_type(galaxy_manager))
+        return discerners
+    # each worker only gets its own galaxy and returns the index (labels and positions)
+    with concurrent.futures.ProcessPoolExecutor(min(max_workers, len(galaxy_names))) as executor:
+        futures = [
+            executor.submit(
+                _build_discerner_index,
+                galaxy_name,
+                source,
+                galaxy_manager.get_galaxy(galaxy_name),
+            )
+            for galaxy_name in galaxy_names
+        ]
+        return [
+            discerner.BaseDiscerner.create_class(galaxy_name, source)(
+                galaxy_manager, index=future.result()
+            )
+            for galaxy_name, future in zip(galaxy_names, futures)
+        ]
 
 
 def get_discerned_tags(
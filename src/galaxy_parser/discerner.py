@@ -1,13 +1,18 @@
 # Copyright 2022 VMware, Inc.
 # SPDX-License-Identifier: BSD-2
 import abc
+import bisect
 import dataclasses
 import difflib
+import functools
 import re
+import types
 
+from typing import AbstractSet
 from typing import cast
 from typing import Dict
 from typing import List
+from typing import Mapping
 from typing import Type
 from typing import TypeVar
 from typing import Optional
@@ -16,8 +21,25 @@ from galaxy_parser import galaxy
 from galaxy_parser import exceptions
 
 
-@dataclasses.dataclass
+# Characters dropped when normalizing a label
+_NORMALIZE_TABLE = str.maketrans("", "", " -_")
+
+
+@functools.lru_cache(maxsize=8192)
+def _normalize(label: str) -> str:
+    """Normalize a label removing spaces and converting it to lower case."""
+    return label.translate(_NORMALIZE_TABLE).strip().lower()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_separators_regex(separators: str) -> re.Pattern:
+    """Compile a regex splitting on any (sequence) of the given separator characters."""
+    return re.compile(f"[{re.escape(separators)}]+")
+
+
+@dataclasses.dataclass(slots=True)
 class Discernment:
+    """Result of a discernment; 'raw_data' is the galaxy entry shared with the discerner."""
 
     label: str
     discerned_name: str
@@ -42,12 +64,12 @@ class AbstractDiscerner(abc.ABC):
         "backdoor",
     ])
 
-    SEPARATORS = ", "
+    SEPARATORS = ","
 
     @staticmethod
     def normalize(label: str) -> str:
         """Normalize a label removing spaces and converting it to lower case."""
-        return label.strip().lower().replace(" ", "").replace("-", "").replace("_", "")
+        return _normalize(label)
 
     @property
     @abc.abstractmethod
@@ -61,7 +83,7 @@ class AbstractDiscerner(abc.ABC):
 
     @classmethod
     def _partial_match(cls, query_string: str, dataset_string: str) -> bool:
-        """Return whether something should be considered a partial match."""
+        """Return whether something should be considered a partial match (prefix-based)."""
         return dataset_string.startswith(query_string)
 
     @abc.abstractmethod
@@ -104,11 +126,19 @@ class AbstractDiscerner(abc.ABC):
         separators: Optional[str] = None,
         hint: Optional[str] = None,
     ) -> List[Discernment]:
-        """Decompose a label (useful with compound words), and then discern."""
+        """Decompose a label (useful with compound words) on any separator, and then discern."""
         if not separators:
             separators = self.SEPARATORS
+        if len(separators) == 1:
+            label_fragments = label.split(separators)
+        else:
+            label_fragments = _get_separators_regex(separators).split(label)
         ret = []
-        for label_fragment in label.split(separators):
+        for label_fragment in label_fragments:
+            label_fragment = label_fragment.strip()
+            # leading or trailing separators yield empty fragments that would match anything
+            if not label_fragment:
+                continue
             try:
                 discernment = self.discern(label_fragment, include_partial_matches, hint)
                 ret.append(discernment)
@@ -124,30 +154,65 @@ class BaseDiscerner(AbstractDiscerner, abc.ABC):
 
     SOURCE_NAME = None
 
+    # Dynamically created classes, so that the same (cluster, source) always maps to the same type
+    _CLASS_CACHE = {}
+
     @classmethod
     def create_class(
         cls,
         cluster: str,
         source: Optional[str] = None,
     ) -> Type[galaxy.BaseGalaxyManagerSubType]:
-        """Dynamically create a new type given a cluster name."""
+        """Dynamically create a new type given a cluster name (or reuse a previous one)."""
         if not source:
             source = "custom"
-        class_name = f"DiscernerClass_{cluster}_{source}"
-        return cast(
-            Type[galaxy.BaseGalaxyManagerSubType],
-            type(class_name, (cls,), {"GALAXY_NAME": cluster, "SOURCE_NAME": source})
-        )
-
-    def __init__(self, galaxy_manager: galaxy.BaseGalaxyManagerSubType) -> None:
-        """Constructor."""
+        key = (cls, cluster, source)
+        if key not in cls._CLASS_CACHE:
+            class_name = f"DiscernerClass_{cluster}_{source}"
+            cls._CLASS_CACHE[key] = type(
+                class_name, (cls,), {"GALAXY_NAME": cluster, "SOURCE_NAME": source}
+            )
+        return cast(Type[galaxy.BaseGalaxyManagerSubType], cls._CLASS_CACHE[key])
+
+    def __init__(
+        self,
+        galaxy_manager: galaxy.BaseGalaxyManagerSubType,
+        index: Optional[Dict] = None,
+    ) -> None:
+        """Constructor (optionally with a pre-built index)."""
         galaxy_object = galaxy_manager.get_galaxy(self.GALAXY_NAME)
+        if index is None:
+            index = self._build_index(galaxy_object)
+        self._set_index(galaxy_object, index)
+
+    def _set_index(self, galaxy_object: Dict, index: Dict) -> None:
+        """Set the index, resolving entry positions against the galaxy values."""
+        galaxy_values = galaxy_object["values"]
+        self._index_by_normalized_label = index["index_by_normalized_label"]
+        self._entries = [galaxy_values[x] for x in index["entry_positions"]]
+        self._values = [x["value"] for x in self._entries]
+        self.sorted_normalized_labels = index["sorted_normalized_labels"]
+        self._entry_by_normalized_label = None
 
+    @classmethod
+    def _build_index(cls, galaxy_object: Dict) -> Dict:
+        """Index all galaxy values and their synonyms by normalized label.
+
+        The index only holds labels and positions, so it is cheap to pass between processes:
+        each label maps to an entry, and each entry to its position among the galaxy values.
+        """
+        galaxy_values = galaxy_object["values"]
         # Index all values and keep track of "original" and "unique" values
-        self.entry_by_normalized_label = {}
+        index_by_normalized_label = {}
+        entry_positions = []
         unique_labels = set([])
-        for entry in galaxy_object["values"]:
-            self.entry_by_normalized_label[self.normalize(entry["value"])] = entry
+        for position, entry in enumerate(galaxy_values):
+            normalized_label = cls.normalize(entry["value"])
+            if normalized_label in index_by_normalized_label:
+                entry_positions[index_by_normalized_label[normalized_label]] = position
+            else:
+                index_by_normalized_label[normalized_label] = len(entry_positions)
+                entry_positions.append(position)
             unique_labels.add(entry["value"])
             # Malpedia Fix:
             #   if we have 'BlackMatter (Windows)' also add 'BlackMatter' so when we look
@@ -155,16 +220,38 @@ class BaseDiscerner(AbstractDiscerner, abc.ABC):
             unique_labels.add(re.sub(r"[\(\[].*?[\)\]]", "", entry["value"]).strip(" "))
 
         # Analyze all data entries and get the synonyms from the "meta" structure which are new
-        entry_by_normalized_label_synonym = {}
-        for entry in self.entry_by_normalized_label.values():
+        index_by_normalized_label_synonym = {}
+        for idx, position in enumerate(entry_positions):
+            entry = galaxy_values[position]
             label_synonyms = [x for x in entry.get("meta", {}).get("synonyms", [])]
             for label_synonym in label_synonyms:
                 if label_synonym not in unique_labels:
-                    entry_by_normalized_label_synonym[self.normalize(label_synonym)] = entry
+                    index_by_normalized_label_synonym[cls.normalize(label_synonym)] = idx
+
+        # Combine, leaving out blacklisted labels so that any hit in the index is a valid one
+        index_by_normalized_label |= index_by_normalized_label_synonym
+        for normalized_label in cls.BLACKLIST:
+            index_by_normalized_label.pop(normalized_label, None)
+        return {
+            "index_by_normalized_label": index_by_normalized_label,
+            "entry_positions": entry_positions,
+            # sorted so that prefix-based partial matches can be found with a bisection
+            "sorted_normalized_labels": sorted(index_by_normalized_label.keys()),
+        }
 
-        # Combine
-        self.entry_by_normalized_label |= entry_by_normalized_label_synonym
-        self.unique_normalized_labels = set(self.entry_by_normalized_label.keys())
+    @property
+    def entry_by_normalized_label(self) -> Mapping[str, Dict]:
+        """Return a read-only mapping of galaxy entries by normalized label (built once)."""
+        if self._entry_by_normalized_label is None:
+            self._entry_by_normalized_label = types.MappingProxyType({
+                k: self._entries[v] for k, v in self._index_by_normalized_label.items()
+            })
+        return self._entry_by_normalized_label
+
+    @property
+    def unique_normalized_labels(self) -> AbstractSet[str]:
+        """Return a read-only set-like view of the normalized labels."""
+        return self._index_by_normalized_label.keys()
 
     @property
     def source(self) -> str:
@@ -179,30 +266,41 @@ class BaseDiscerner(AbstractDiscerner, abc.ABC):
     def _discern(self, label: str, include_partial_matches: bool = False) -> Dict[str, Dict]:
         """Do the discernment."""
         normalized_label = self.normalize(label)
+        # after normalizing we try to get a precise match (blacklisted labels are not indexed)
+        idx = self._index_by_normalized_label.get(normalized_label)
+        if idx is not None:
+            return {self._values[idx]: self._entries[idx]}
         if normalized_label in self.BLACKLIST:
             raise exceptions.FailedDiscernment
-        try:
-            # after normalizing we try to get a precise match
-            return {
-                self.entry_by_normalized_label[normalized_label]["value"]:
-                    self.entry_by_normalized_label[normalized_label]
-            }
-        except KeyError:
-            # if we fail we start considering whether using a partial would give us a result
-            if include_partial_matches:
-                ret = {}
-                for unique_normalized_label in self.unique_normalized_labels:
-                    # a partial match is partial in two ways:
-                    #   1) because the label we are looking can match only one word
-                    #   2) because the match is not really exact
-                    if self._partial_match(normalized_label, unique_normalized_label):
-                        ret[self.entry_by_normalized_label[unique_normalized_label]["value"]] = (
-                            self.entry_by_normalized_label[unique_normalized_label]
-                        )
-                # partial matches are partial so there can be more than one
-                if ret:
-                    return ret
-            raise exceptions.FailedDiscernment
+        # if we fail we start considering whether using a partial would give us a result
+        if include_partial_matches:
+            ret = {}
+            # labels sharing the same prefix are contiguous once sorted, so we can jump
+            # to the first candidate and stop as soon as a label does not match anymore;
+            # this only holds for the default (prefix-based) partial match, so if a subclass
+            # overrides it we fall back to scanning all labels
+            prefix_based = (
+                type(self)._partial_match.__func__ is AbstractDiscerner._partial_match.__func__
+            )
+            if prefix_based:
+                start = bisect.bisect_left(self.sorted_normalized_labels, normalized_label)
+            else:
+                start = 0
+            for position in range(start, len(self.sorted_normalized_labels)):
+                unique_normalized_label = self.sorted_normalized_labels[position]
+                # a partial match is partial in two ways:
+                #   1) because the label we are looking can match only one word
+                #   2) because the match is not really exact
+                if not self._partial_match(normalized_label, unique_normalized_label):
+                    if prefix_based:
+                        break
+                    continue
+                idx = self._index_by_normalized_label[unique_normalized_label]
+                ret[self._values[idx]] = self._entries[idx]
+            # partial matches are partial so there can be more than one
+            if ret:
+                return ret
+        raise exceptions.FailedDiscernment
 
 
 class MispActorDiscerner(BaseDiscerner):
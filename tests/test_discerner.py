@@ -0,0 +1,126 @@
+import unittest
+
+from galaxy_parser import discerner
+from galaxy_parser import exceptions
+
+
+class FakeGalaxyManager:
+    """Galaxy manager serving a single in-memory galaxy."""
+
+    GALAXY = {
+        "type": "threat-actor",
+        "values": [
+            {"value": "APT28", "meta": {"synonyms": ["Fancy Bear", "Sednit"]}},
+            {"value": "Lazarus Group", "meta": {"synonyms": ["Hidden Cobra"]}},
+            {"value": "APT29", "meta": {"synonyms": ["Cozy Bear"]}},
+            {"value": "APT3"},
+            {"value": "APT33"},
+            {"value": "Trojan"},
+            {"value": "TrojanSpy"},
+        ],
+    }
+
+    def get_galaxy(self, galaxy_name):
+        """Return the in-memory galaxy."""
+        return self.GALAXY
+
+
+class TestDiscerner(unittest.TestCase):
+    """Class to test the discerners."""
+
+    def setUp(self):
+        """Create a discerner on top of the in-memory galaxy."""
+        new_type = discerner.BaseDiscerner.create_class("threat-actor", "test")
+        self.discerner = new_type(FakeGalaxyManager())
+
+    def _discern_compound(self, label, **kwargs):
+        """Return the discerned names of a compound label."""
+        return [x.discerned_name for x in self.discerner.discern_compound(label, **kwargs)]
+
+    def _discern_partial(self, label, discerner_object=None):
+        """Return the discerned names of a label allowing partial matches."""
+        discerner_object = discerner_object or self.discerner
+        return sorted(discerner_object._discern(label, include_partial_matches=True).keys())
+
+    def test_discern_partial_several_matches(self):
+        """Test that a prefix returns all the labels starting with it."""
+        self.assertEqual(self._discern_partial("apt"), ["APT28", "APT29", "APT3", "APT33"])
+        self.assertEqual(self._discern_partial("apt2"), ["APT28", "APT29"])
+        self.assertEqual(self._discern_partial("fancy"), ["APT28"])
+
+    def test_discern_partial_no_matches(self):
+        """Test that a prefix matching no label fails."""
+        with self.assertRaises(exceptions.FailedDiscernment):
+            self._discern_partial("apt4")
+        with self.assertRaises(exceptions.FailedDiscernment):
+            self._discern_partial("zzz")
+
+    def test_discern_partial_exact_label(self):
+        """Test that a prefix which is also a label returns only the exact match."""
+        self.assertEqual(self._discern_partial("apt3"), ["APT3"])
+        self.assertEqual(self._discern_partial("apt33"), ["APT33"])
+
+    def test_discern_partial_overridden_match(self):
+        """Test that overriding the partial match is honored for labels not sharing a prefix."""
+
+        class SubstringDiscerner(discerner.BaseDiscerner):
+
+            GALAXY_NAME = "threat-actor"
+
+            SOURCE_NAME = "test"
+
+            @classmethod
+            def _partial_match(cls, query_string, dataset_string):
+                return query_string in dataset_string
+
+        substring_discerner = SubstringDiscerner(FakeGalaxyManager())
+        self.assertEqual(self._discern_partial("bear", substring_discerner), ["APT28", "APT29"])
+        self.assertEqual(self._discern_partial("cobra", substring_discerner), ["Lazarus Group"])
+
+    def test_discern_blacklisted_exact(self):
+        """Test that a blacklisted label is not discerned even if it is in the galaxy."""
+        with self.assertRaises(exceptions.FailedDiscernment):
+            self.discerner.discern("Trojan")
+        self.assertEqual(self.discerner.discern("TrojanSpy").discerned_name, "TrojanSpy")
+
+    def test_discern_blacklisted_partial(self):
+        """Test that a blacklisted label is not returned as a partial match."""
+        self.assertEqual(self._discern_partial("tro"), ["TrojanSpy"])
+        with self.assertRaises(exceptions.FailedDiscernment):
+            self._discern_partial("trojan")
+
+    def test_discern_compound_multi_word_label(self):
+        """Test that multi-word labels are not split on spaces."""
+        self.assertEqual(self._discern_compound("Lazarus Group"), ["Lazarus Group"])
+        self.assertEqual(
+            self._discern_compound("Fancy Bear, Hidden Cobra"), ["APT28", "Lazarus Group"]
+        )
+
+    def test_discern_compound_separators(self):
+        """Test that labels are split on commas, with or without spaces."""
+        self.assertEqual(self._discern_compound("apt28,sednit"), ["APT28", "APT28"])
+        self.assertEqual(
+            self._discern_compound("APT28, Lazarus Group"), ["APT28", "Lazarus Group"]
+        )
+        self.assertEqual(self._discern_compound(", APT28,"), ["APT28"])
+
+    def test_discern_compound_explicit_separators(self):
+        """Test that an explicit set of separators splits on any of its characters."""
+        self.assertEqual(
+            self._discern_compound("apt28;sednit/hidden-cobra", separators=";/"),
+            ["APT28", "APT28", "Lazarus Group"],
+        )
+
+    def test_entry_by_normalized_label(self):
+        """Test that entries can still be looked up by normalized label."""
+        entry_by_normalized_label = self.discerner.entry_by_normalized_label
+        self.assertEqual(entry_by_normalized_label["fancybear"]["value"], "APT28")
+        self.assertEqual(entry_by_normalized_label["lazarusgroup"]["value"], "Lazarus Group")
+        self.assertEqual(self.discerner.unique_normalized_labels, set(entry_by_normalized_label))
+        self.assertIs(self.discerner.entry_by_normalized_label, entry_by_normalized_label)
+        with self.assertRaises(TypeError):
+            entry_by_normalized_label["apt1"] = {}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import importlib.util
+import os
+import unittest
+
+try:
+    import pymisp  # noqa: F401
+except ImportError:
+    pymisp = None
+
+
+def load_script():
+    """Load the 'update_cluster_tags.py' script as a module."""
+    script_path = os.path.join(os.path.dirname(__file__), "..", "bin", "update_cluster_tags.py")
+    spec = importlib.util.spec_from_file_location("update_cluster_tags", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeTag:
+    """Tag with just a name."""
+
+    def __init__(self, name):
+        """Constructor."""
+        self.name = name
+
+
+class FakeEntity:
+    """Event or attribute with just tags."""
+
+    def __init__(self, tag_names):
+        """Constructor."""
+        self.tags = [FakeTag(x) for x in tag_names]
+
+
+class FakeMISP:
+    """MISP client recording the calls that modify entities."""
+
+    def __init__(self):
+        """Constructor."""
+        self.search_tags_calls = []
+        self.tagged = []
+        self.untagged = []
+
+    def search_tags(self, tag, pythonify=False):
+        """Return an existing tag object."""
+        self.search_tags_calls.append(tag)
+        return [FakeTag(tag)]
+
+    def tag(self, entity, tag):
+        """Record the tag being added."""
+        self.tagged.append((entity, tag.name))
+
+    def untag(self, entity, tag):
+        """Record the tag being removed."""
+        self.untagged.append((entity, tag.name))
+
+
+@unittest.skipIf(pymisp is None, "pymisp is not installed")
+class TestUpdateClusterTags(unittest.TestCase):
+    """Class to test the 'update_cluster_tags.py' script."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Load the script once."""
+        cls.script = load_script()
+
+    def test_get_tag_by_synonym(self):
+        """Test that synonyms map to their tag, and the first tag wins on conflicts."""
+        tag_synonyms = {
+            "a": {"a1", "a2"},
+            "b": {"b1", "a1"},
+        }
+        conflicting_tags = {}
+        tag_by_synonym = self.script.get_tag_by_synonym(tag_synonyms, conflicting_tags)
+        self.assertEqual(tag_by_synonym, {"a1": "a", "a2": "a", "b1": "b"})
+        self.assertEqual(conflicting_tags, {"a1": {"b"}})
+        self.assertEqual(self.script.get_tag_by_synonym(tag_synonyms), tag_by_synonym)
+
+    def test_get_tag_suffix(self):
+        """Test that the suffix is whatever follows the last separator."""
+        self.assertEqual(self.script.get_tag_suffix("x - y - T1001"), "T1001")
+        self.assertEqual(self.script.get_tag_suffix("T1001"), "T1001")
+        self.assertEqual(self.script.get_tag_suffix("x | T1001", " | "), "T1001")
+
+    def test_get_tag_by_suffix(self):
+        """Test that suffixes map to their tag, and the last tag in order wins on conflicts."""
+        tags = ["Old - T1001", "New - T1002", "Newer - T1001"]
+        self.assertEqual(
+            self.script.get_tag_by_suffix(tags),
+            {"T1001": "Newer - T1001", "T1002": "New - T1002"},
+        )
+
+    def test_search_and_replace_tags(self):
+        """Test that each new tag is added once, and all old tags are removed."""
+        misp = FakeMISP()
+        old_tag_to_new_tag = {"old1": "new", "old2": "new"}
+        tag_object_by_name = {}
+        # two old tags mapping to the same new tag
+        entity = FakeEntity(["old1", "other", "old2"])
+        self.script.search_and_replace_tags(misp, entity, old_tag_to_new_tag, tag_object_by_name)
+        self.assertEqual(misp.tagged, [(entity, "new")])
+        self.assertEqual(misp.untagged, [(entity, "old1"), (entity, "old2")])
+        # the new tag is already there
+        misp.tagged, misp.untagged = [], []
+        entity = FakeEntity(["old1", "new"])
+        self.script.search_and_replace_tags(misp, entity, old_tag_to_new_tag, tag_object_by_name)
+        self.assertEqual(misp.tagged, [])
+        self.assertEqual(misp.untagged, [(entity, "old1")])
+        # the tag object is looked up only once
+        misp.tagged, misp.untagged = [], []
+        entity = FakeEntity(["old2"])
+        self.script.search_and_replace_tags(misp, entity, old_tag_to_new_tag, tag_object_by_name)
+        self.assertEqual(misp.tagged, [(entity, "new")])
+        self.assertEqual(misp.untagged, [(entity, "old2")])
+        self.assertEqual(misp.search_tags_calls, ["new"])
+
+
+if __name__ == "__main__":
+    unittest.main()